@@ -1,10 +1,13 @@
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import re
-import time
+import io
 import pandas as pd
 import json
-from bs4 import BeautifulSoup
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from bs4 import BeautifulSoup, SoupStrainer
 from urllib.parse import urljoin
 import openai
 
@@ -30,20 +33,93 @@ results_url = st.text_input(
 
 # --- Helper Functions ---
 
+# Number of report pages fetched concurrently; also caps the load we put on the server
+MAX_WORKERS = 8
+
+# The results page is only used for its summary table, so skip building the rest of the DOM
+_TABLES_ONLY = SoupStrainer("table")
+
+# Output column names for the first 20 <td> cells of each summary table row, in order
+SUMMARY_COLUMNS = [
+    "Name", "Date Sampled", "Sample No", "Lab Number",
+    "Soil pH", "Buffer pH",
+    "P (lbs/A)", "K (lbs/A)", "Ca (lbs/A)", "Mg (lbs/A)",
+    "Zn (lbs/A)", "Mn (lbs/A)", "Cu (lbs/A)", "B (lbs/A)",
+    "Na (lbs/A)", "S (lbs/A)",
+    "EC (mmhos/cm)", "NO3-N (ppm)", "OM (%)", "Bulk Density (lbs/A)",
+]
+# Lab measurements, from Soil pH onward
+NUMERIC_COLUMNS = SUMMARY_COLUMNS[4:]
+
+# The account number is the digits of the sample number
+_NON_DIGIT_RE = re.compile(r"\D")
+
+# Longest Retry-After we wait out, so a throttled server cannot park a fetch worker
+RETRY_AFTER_CAP = 10
+
+
+class _CappedRetry(Retry):
+    """Retry that honours Retry-After, but never sleeps longer than RETRY_AFTER_CAP seconds."""
+
+    def parse_retry_after(self, retry_after: str) -> float:
+        return min(super().parse_retry_after(retry_after), RETRY_AFTER_CAP)
+
+
+@st.cache_resource
+def get_adapter() -> HTTPAdapter:
+    """
+    Returns the shared connection pool. Kept across Streamlit reruns so its keep-alive
+    connections are reused by later scrapes instead of being re-established.
+    """
+    # One pooled keep-alive connection per fetch worker, reused across all report pages.
+    # Transient connection errors, rate limiting and 5xx responses are retried with
+    # backoff, waiting out the server's Retry-After up to RETRY_AFTER_CAP. requests already
+    # negotiates compressed bodies: gzip/deflate always, and br when brotli is installed
+    # (see requirements.txt).
+    retries = _CappedRetry(total=3, backoff_factor=0.3, status_forcelist=(429, 500, 502, 503, 504))
+    return HTTPAdapter(pool_connections=1, pool_maxsize=MAX_WORKERS, max_retries=retries)
+
+
+def get_session() -> requests.Session:
+    """
+    Returns a new HTTP session for one scrape, mounted on the shared adapter. Cookies
+    (such as the site's ASP.NET session) stay with that scrape instead of every user.
+    Do not close it: closing a session also closes the shared adapter's pool.
+    """
+    session = requests.Session()
+    session.headers.update({"User-Agent": "Mozilla/5.0"})
+    adapter = get_adapter()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+@st.cache_data(ttl=300, show_spinner=False)
+def fetch_results_page(_session: requests.Session, url: str) -> bytes:
+    """
+    Fetches the results page HTML. Cached on the URL for a few minutes so repeat
+    scrapes of the same search skip the request while new results still show up soon.
+    """
+    res = _session.get(url, timeout=30)
+    res.raise_for_status()
+    return res.content
+
+
 def get_report_url(base_results_url: str, href: str) -> str:
     """Constructs the full URL for the report page."""
     return urljoin(base_results_url, href)
 
 
-def extract_initial_data_with_bs(html_content: str):
+# Patterns used by the crop/lime extractor, compiled once at import
+_NUMBER_RE = re.compile(r"([0-9]+(?:\.[0-9]+)?)")
+_CROP_LINE_RE = re.compile(r"\bCrop\s*:\s*(.+)", re.IGNORECASE)
+_LIME_RATE_RE = re.compile(r"\b([0-9]+(?:\.[0-9]+)?)\s*lbs/1000")
+
+def extract_initial_data_with_bs(soup: BeautifulSoup):
     """
     (Web Scraping) Extracts initial data using BeautifulSoup by navigating the HTML table.
     This version is more robust and accurate for the initial pass.
     """
-    if not html_content:
-        return "None", "None"
-        
-    soup = BeautifulSoup(html_content, "html.parser")
     crop = "None"
     lime = "None"
     
@@ -66,25 +142,21 @@ def extract_initial_data_with_bs(html_content: str):
                 # The last cell contains the lime value
                 if len(cells) > 1 and cells[-1].find('b'):
                     lime_text = cells[-1].find('b').get_text(strip=True)
-                    lime_match = re.search(r"([0-9]+(?:\.[0-9]+)?)", lime_text)
+                    lime_match = _NUMBER_RE.search(lime_text)
                     if lime_match:
                         lime = lime_match.group(1)
 
     except Exception:
         # Fallback to the original regex method if the table navigation fails
         text = soup.get_text()
-        crop_match = re.search(r"Crop\s*:\s*(.+)", text, re.IGNORECASE)
+        crop_match = _CROP_LINE_RE.search(text)
         if crop_match:
             crop = crop_match.group(1).strip()
         
-        lime_match = re.search(r"([0-9]+(?:\.[0-9]+)?)\s*lbs/1000", text)
+        lime_match = _LIME_RATE_RE.search(text)
         if lime_match:
             lime = lime_match.group(1)
 
-    # Final check for "no lime" text on the page as a fallback
-    if lime == "None" and "no lime" in soup.get_text(strip=True).lower():
-        lime = "None"
-
     return crop, lime
 
 
@@ -95,27 +167,84 @@ _PHOS_RE = re.compile(
     r"(?i)\b(\d+(?:\.\d+)?)\s*(?:lb|lbs|pounds)\s+triple\s+phosphate\s*\(\s*0\s*[-–—]\s*46\s*[-–—]\s*0\s*\)"
 )
 
-def extract_phosphorus_lbs_from_html(html_content: str) -> str:
+def extract_phosphorus_lbs_from_text(text: str) -> str:
     """Return the numeric lbs of triple phosphate from the Comments section, or 'None'."""
+    m = _PHOS_RE.search(text)
+    return m.group(1) if m else "None"
+
+
+# Crop names the crop screen looks for
+SCREEN_CROPS = ("WarmSeasonGrsMaint(sq ft)", "CoolSeasonGrsMaint(sq ft)", "Centipedegrass(sq ft)")
+_SCREEN_CROP_STEMS = tuple(name.split("(")[0] for name in SCREEN_CROPS)
+# One alternation resolves any of the names in a single pass. Whitespace is allowed around
+# "(sq ft)" because get_text inserts spaces at tag boundaries (e.g. <b>Name</b>(sq ft)).
+# Group i + 1 matches SCREEN_CROPS[i].
+_SCREEN_CROPS_RE = re.compile("|".join(
+    rf"({re.escape(stem)}\s*\(\s*sq\s*ft\s*\))" for stem in _SCREEN_CROP_STEMS
+))
+# Looser hint: a crop stem in any form. Reports with a hint but no exact match go to the AI.
+_SCREEN_HINT_RE = re.compile("|".join(re.escape(stem) for stem in _SCREEN_CROP_STEMS), re.IGNORECASE)
+
+def extract_report_fields(html_content: bytes):
+    """
+    Parses a report page once and returns (crop, lime, phosphorus, screen_crop, screen_html).
+    All extractors share the same soup and page text instead of re-parsing the HTML.
+    screen_crop is the SCREEN_CROPS name found on the page, else "". screen_html is the
+    page HTML only when it hints at a screen crop that could not be resolved locally, else "".
+    """
     if not html_content:
-        return "None"
+        return "None", "None", "None", "", ""
+
+    soup = BeautifulSoup(html_content, "lxml")
+    try:
+        crop, lime = extract_initial_data_with_bs(soup)
+        screen_crop = ""
+        screen_html = ""
+        try:
+            # Normalize whitespace/newlines so regex can match across line breaks
+            text = " ".join(soup.get_text(separator=" ").split())
+            phosphorus = extract_phosphorus_lbs_from_text(text)
+            crop_match = _SCREEN_CROPS_RE.search(text)
+            if crop_match:
+                screen_crop = SCREEN_CROPS[crop_match.lastindex - 1]
+            elif _SCREEN_HINT_RE.search(text):
+                screen_html = soup.decode()
+        except Exception:
+            phosphorus = "None"
+    finally:
+        # The tree's parent/child links form reference cycles; break them so the
+        # memory is released now rather than at the next garbage collection
+        soup.decompose()
+
+    return crop, lime, phosphorus, screen_crop, screen_html
+
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def _fetch_and_parse_report(_session: requests.Session, report_url: str):
+    """
+    Fetches and parses one report page. Cached on the URL for an hour so repeat scrapes
+    of the same lab range skip the network and parsing; errors propagate and are not cached.
+    """
+    report_resp = _session.get(report_url, timeout=15)
+    report_resp.raise_for_status()
+    return extract_report_fields(report_resp.content)
+
+
+def scrape_report(session: requests.Session, report_url: str):
+    """Returns (crop, lime, phosphorus, screen_crop, screen_html) for one report, or the empty defaults on failure."""
     try:
-        soup = BeautifulSoup(html_content, "html.parser")
-        # Normalize whitespace/newlines so regex can match across line breaks
-        text = " ".join(soup.get_text(separator=" ").split())
-        m = _PHOS_RE.search(text)
-        return m.group(1) if m else "None"
+        return _fetch_and_parse_report(session, report_url)
     except Exception:
-        return "None"
+        return extract_report_fields(b"")
 
 
-def find_specific_crop_with_openai(client: openai.OpenAI, html_content: str):
+@st.cache_data(max_entries=1000, show_spinner=False)
+def _ask_openai_for_crop(_client: openai.OpenAI, html_content: str) -> str:
     """
-    (AI Powered) Uses an OpenAI model to find the specific crop type.
+    Runs the crop prompt for one report. Cached on the report content so repeat
+    screens of unchanged reports skip the API call; errors propagate and are not cached.
+    The cache is held in memory and max_entries bounds it, so it does not survive restarts.
     """
-    if not html_content:
-        return "None"
-
     system_prompt = """
     You are an expert data extractor. Analyze the provided HTML. Your task is to find if one of the following exact crop names exists in the text: 
     "WarmSeasonGrsMaint(sq ft)", "CoolSeasonGrsMaint(sq ft)", "Centipedegrass(sq ft)".
@@ -123,21 +252,59 @@ def find_specific_crop_with_openai(client: openai.OpenAI, html_content: str):
     If you do not find an exact match, the value for "crop" should be "None".
     """
 
+    response = _client.chat.completions.create(
+        model="gpt-4o-mini",
+        response_format={"type": "json_object"},
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": html_content}
+        ]
+    )
+    data = json.loads(response.choices[0].message.content)
+    return data.get("crop", "None")
+
+
+def find_specific_crop_with_openai(client: openai.OpenAI, html_content: str):
+    """
+    (AI Powered) Uses an OpenAI model to find the specific crop type.
+    Returns (crop, error). It does not touch the UI, so it can run in worker threads.
+    """
+    if not html_content:
+        return "None", None
+
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            response_format={"type": "json_object"},
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": html_content}
-            ]
-        )
-        data = json.loads(response.choices[0].message.content)
-        return data.get("crop", "None")
+        return _ask_openai_for_crop(client, html_content), None
 
     except (json.JSONDecodeError, AttributeError, Exception) as e:
-        st.warning(f"AI extraction failed for one report. Details: {e}")
-        return "None"
+        return "None", str(e)
+
+
+def numeric_view(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Returns a copy with the measurement columns as nullable numbers, so the table view
+    sorts them numerically. Blanks become missing values; a column with any other
+    non-numeric entry ("<0.1", ...) stays text. The stored lab text, and so the CSV, is untouched.
+    """
+    view = df.copy()
+    for col in NUMERIC_COLUMNS:
+        try:
+            view[col] = pd.to_numeric(df[col].mask(df[col] == "")).astype("Float64")
+        except (ValueError, TypeError):
+            pass
+    return view
+
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def to_csv_bytes(df: pd.DataFrame) -> bytes:
+    """
+    Serializes the results for download. Cached so the CSV is only rebuilt when the
+    data changes, not on every rerun triggered by unrelated widgets. Only the most
+    recent frames are kept, so past scrapes do not pile up in server memory.
+    """
+    # Write straight into a bytes buffer instead of building a str and re-encoding it
+    csv_buf = io.BytesIO()
+    df.to_csv(csv_buf, index=False, encoding="utf-8")
+    return csv_buf.getvalue()
 
 
 # --- Main Application Logic ---
@@ -151,102 +318,133 @@ if st.button("Start Scraping", type="primary"):
         st.stop()
 
     with st.spinner("Scraping Clemson soil reports... (Initial Pass)"):
-        session = requests.Session()
-        session.headers.update({"User-Agent": "Mozilla/5.0"})
+        session = get_session()
         try:
-            res = session.get(results_url, timeout=30)
-            res.raise_for_status()
+            results_html = fetch_results_page(session, results_url)
         except Exception as exc:
             st.error(f"Failed to load results page: {exc}")
             st.stop()
 
-        main_soup = BeautifulSoup(res.text, "html.parser")
-        summary_tbl = next((t for t in main_soup.find_all("table") if "Sample No" in t.get_text()), None)
+        main_soup = BeautifulSoup(results_html, "lxml", parse_only=_TABLES_ONLY)
+        # Anchor on the "Sample No" header text and take its outermost enclosing table,
+        # rather than building the full text of every table on the page
+        sample_no_cell = main_soup.find(string=lambda t: t and "Sample No" in t)
+        enclosing_tables = sample_no_cell.find_parents("table") if sample_no_cell else []
+        if enclosing_tables:
+            summary_tbl = enclosing_tables[-1]
+        else:
+            # Header text split across tags; fall back to scanning each table's text
+            summary_tbl = next((t for t in main_soup.find_all("table") if "Sample No" in t.get_text()), None)
         if not summary_tbl:
             st.error("Could not find the main results table on that page.")
             st.stop()
 
-        records = []
-        rows = summary_tbl.find_all("tr")[1:]
-        progress_bar = st.progress(0, text="Scraping initial data...")
-
-        for i, tr in enumerate(rows):
-            td = tr.find_all("td")
+        rows = []
+        report_urls = []
+        for tr in summary_tbl.find_all("tr")[1:]:
+            # Only the row's own cells; avoids descending into any nested markup
+            td = tr.find_all("td", recursive=False)
             if len(td) < 20: 
                 continue
 
             href_tag = td[3].find("a")
             href = href_tag["href"] if href_tag else ""
-            report_url = get_report_url(results_url, href) if href else ""
-            
-            report_html_content = ""
-            if report_url:
-                try:
-                    report_resp = session.get(report_url, timeout=15)
-                    if report_resp.ok:
-                        report_html_content = report_resp.text
-                except Exception:
-                    pass
-
-            crop_type, lime_val = extract_initial_data_with_bs(report_html_content)
-            phosphorus_val = extract_phosphorus_lbs_from_html(report_html_content)
-
-            records.append({
-                "Account Number": re.sub(r"\D", "", td[2].get_text(strip=True)),
-                "Name": td[0].get_text(strip=True),
-                "Date Sampled": td[1].get_text(strip=True),
-                "Sample No": td[2].get_text(strip=True),
-                "Lab Number": td[3].get_text(strip=True),
-                "Soil pH": td[4].get_text(strip=True), "Buffer pH": td[5].get_text(strip=True),
-                "P (lbs/A)": td[6].get_text(strip=True), "K (lbs/A)": td[7].get_text(strip=True),
-                "Ca (lbs/A)": td[8].get_text(strip=True), "Mg (lbs/A)": td[9].get_text(strip=True),
-                "Zn (lbs/A)": td[10].get_text(strip=True), "Mn (lbs/A)": td[11].get_text(strip=True),
-                "Cu (lbs/A)": td[12].get_text(strip=True), "B (lbs/A)": td[13].get_text(strip=True),
-                "Na (lbs/A)": td[14].get_text(strip=True), "S (lbs/A)": td[15].get_text(strip=True),
-                "EC (mmhos/cm)": td[16].get_text(strip=True), "NO3-N (ppm)": td[17].get_text(strip=True),
-                "OM (%)": td[18].get_text(strip=True), "Bulk Density (lbs/A)": td[19].get_text(strip=True),
-                "Crop Type": crop_type, "Lime (lbs/1000 ft²)": lime_val,
-                "Phosphorus (lbs)": phosphorus_val,
-                "_report_html": report_html_content
-            })
-            time.sleep(0.1)  # Be polite
-            progress_bar.progress((i + 1) / len(rows), text=f"Scraping report {i+1}/{len(rows)}")
+            rows.append(td)
+            report_urls.append(get_report_url(results_url, href) if href else "")
+
+        # Rows that link to the same report share a single fetch
+        rows_by_url = {}
+        for i, url in enumerate(report_urls):
+            if url:
+                rows_by_url.setdefault(url, []).append(i)
+
+        # Report pages are independent and network-bound, so fetch them concurrently
+        report_fields = [extract_report_fields(b"")] * len(rows)
+        progress_bar = st.progress(0, text="Scraping initial data...")
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            futures = {executor.submit(scrape_report, session, url): url for url in rows_by_url}
+            for done, future in enumerate(as_completed(futures), start=1):
+                fields = future.result()
+                for i in rows_by_url[futures[future]]:
+                    report_fields[i] = fields
+                progress_bar.progress(done / len(futures), text=f"Scraping report {done}/{len(futures)}")
+
+        # Build the frame column-wise (one list per column) rather than one dict per row
+        data = {name: [] for name in SUMMARY_COLUMNS}
+        data.update({"Crop Type": [], "Lime (lbs/1000 ft²)": [], "Phosphorus (lbs)": [], "_screen_crop": [], "_screen_html": []})
+
+        for td, (crop_type, lime_val, phosphorus_val, screen_crop, screen_html) in zip(rows, report_fields):
+            for name, cell in zip(SUMMARY_COLUMNS, td):
+                data[name].append(cell.get_text(strip=True))
+            data["Crop Type"].append(crop_type)
+            data["Lime (lbs/1000 ft²)"].append(lime_val)
+            data["Phosphorus (lbs)"].append(phosphorus_val)
+            data["_screen_crop"].append(screen_crop)
+            data["_screen_html"].append(screen_html)
 
         progress_bar.empty()
-        st.session_state.df_results = pd.DataFrame(records)
-        st.success("✅ Initial scrape complete!")
+        # dtype=object keeps the text columns string-typed even when no rows were found.
+        df = pd.DataFrame(data, dtype=object)
+        df.insert(0, "Account Number", df["Sample No"].astype(str).str.replace(_NON_DIGIT_RE, "", regex=True))
+        st.session_state.df_results = df
+        if df.empty:
+            st.warning("No sample rows were found in the results table.")
+        else:
+            st.success("✅ Initial scrape complete!")
 
 # --- Display Area ---
 if st.session_state.df_results is not None:
-    df_display = st.session_state.df_results.drop(columns=['_report_html'], errors='ignore')
-    st.dataframe(df_display, use_container_width=True, hide_index=True)
+    df_display = st.session_state.df_results.drop(columns=['_screen_crop', '_screen_html'], errors='ignore')
+    st.dataframe(numeric_view(df_display), use_container_width=True, hide_index=True)
 
-    csv = df_display.to_csv(index=False).encode("utf-8")
-    st.download_button("📥 Download CSV", data=csv, file_name="soil_full_data.csv", mime="text/csv")
+    st.download_button("📥 Download CSV", data=to_csv_bytes(df_display), file_name="soil_full_data.csv", mime="text/csv")
 
     st.markdown("---")
 
     if st.button("Run Crop Screen"):
-        if "OPENAI_API_KEY" not in st.secrets:
-            st.error("OpenAI API key not found. Please add it to your Streamlit secrets.")
-            st.stop()
-        
-        client = openai.OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
-
-        with st.spinner("Running detailed AI crop screen..."):
-            df = st.session_state.df_results.copy()
-            updates_found = 0
-            progress_bar_specific = st.progress(0, text="Starting detailed crop screen...")
-
-            for index, row in df.iterrows():
-                report_html = row["_report_html"]
-                if report_html:
-                    specific_crop = find_specific_crop_with_openai(client, report_html)
-                    if specific_crop and specific_crop.lower() != "none":
-                        df.loc[index, 'Crop Type'] = specific_crop
-                        updates_found += 1
-                progress_bar_specific.progress((index + 1) / len(df), text=f"AI screening report {index + 1}/{len(df)}")
-            
-            progress_bar_specific.empty()
-            st.session_state.df_results = df
-            st.success(f"✅ AI crop screen complete! Found and updated {updates_found} specific crop types.")
+        df = st.session_state.df_results
+        # Collect updates in a plain list and write the column back once at the end
+        crop_types = df["Crop Type"].tolist()
+        updates_found = 0
+
+        # Crop names already resolved during the scrape need no API call
+        for index, screen_crop in enumerate(df["_screen_crop"]):
+            if screen_crop:
+                crop_types[index] = screen_crop
+                updates_found += 1
+
+        # Only reports that hint at a screen crop without an exact match go to the AI
+        pending = [(index, html) for index, html in enumerate(df["_screen_html"]) if html]
+        if pending and "OPENAI_API_KEY" not in st.secrets:
+            # Keep the locally resolved names; only the AI pass is skipped
+            st.warning(
+                f"OpenAI API key not found, so {len(pending)} report(s) without an exact crop "
+                "name were not screened. Please add it to your Streamlit secrets."
+            )
+            pending = []
+
+        if pending:
+            client = openai.OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
+
+            with st.spinner("Running detailed AI crop screen..."):
+                progress_bar_specific = st.progress(0, text="Starting detailed crop screen...")
+
+                # API calls are network-bound, so screen several reports at once
+                with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+                    futures = {
+                        executor.submit(find_specific_crop_with_openai, client, html): index
+                        for index, html in pending
+                    }
+                    for done, future in enumerate(as_completed(futures), start=1):
+                        specific_crop, error = future.result()
+                        if error:
+                            st.warning(f"AI extraction failed for one report. Details: {error}")
+                        elif specific_crop and specific_crop.lower() != "none":
+                            crop_types[futures[future]] = specific_crop
+                            updates_found += 1
+                        progress_bar_specific.progress(done / len(futures), text=f"AI screening report {done}/{len(futures)}")
+
+                progress_bar_specific.empty()
+
+        st.session_state.df_results = df.assign(**{"Crop Type": crop_types})
+        st.success(f"✅ Crop screen complete! Found and updated {updates_found} specific crop types.")